@@ -43,14 +43,12 @@ def get_shortest_path_and_lenght(MAP,start_node,end_node,security):
     return(path,len(path))
 
 def print_path(MAP,path):
-    lgging.debug("Print map for path: %s" % path)
+    logging.debug("Print map for path: %s" % path)
     for n in path:
-        sql="SELECT sid,region,constellation,name,security FROM systems WHERE sid=%s" % (n)
-        cursor.execute(sql)
-        for i in cursor:
-            print(i['sid'],i['region'],i['constellation'],i['name'],i['security'])
-            for e in MAP.edges(i):
-                print ("---",e,MAP.get_edge_data(e[1],e[0]),MAP.get_edge_data(e[0],e[1]))
+        i=MAP.nodes[n]
+        print(n,i['region'],i['constellation'],i['name'],i['security'])
+        for e in MAP.edges(n):
+            print ("---",e,MAP.get_edge_data(e[1],e[0]),MAP.get_edge_data(e[0],e[1]))
 
 def printf(txt):
     print(txt,end="")
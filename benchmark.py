@@ -0,0 +1,418 @@
+# EVE Echoes map benchmark tool
+#
+# Runs the map building, routing and rendering stages of analyze.py against
+# the real csv/systems.csv and against synthetic copies of it scaled to 2x,
+# 10x and 50x. Each copy keeps the region/constellation/security structure
+# of the original and copies are chained together with extra gates.
+#
+# Usage:
+#   python benchmark.py                              Run all scales, write results
+#   python benchmark.py --scales 1 2 --repeat 9     Run selected scales
+#   python benchmark.py --stages add_production_data Run slow stages, not run by default
+#   python benchmark.py --compare bench/base.json    Compare run to a baseline
+#   python benchmark.py --compare-only a.json b.json Compare two results files
+
+# Standard modules
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# PIPed modules
+import matplotlib
+matplotlib.use("Agg")
+import networkx as nx
+
+# Local modules
+import analyze
+import columnar
+import report
+
+DEFAULT_SCALES = [1, 2, 10, 50]
+SYSTEM_ID_OFFSET = 10000000 # ID offset between synthetic copies
+# Smaller differences to baseline are timing and allocation noise, not regressions
+MIN_DIFFERENCE = {'seconds': 0.01, 'peak_bytes': 1048576}
+RESOURCES = ["Base Metals", "Heavy Metals", "Noble Metals", "Reactive Metals", "Toxic Metals",
+             "Condensates", "Lustering Alloy", "Sheen Compound", "Gleaming Alloy", "Silicate Glass"]
+
+def init_logging():
+    logformat="%(asctime)s %(levelname)s %(filename)s %(funcName)s %(message)s"
+    logging.basicConfig(filename='log/benchmark.log',level=logging.INFO,format=logformat,filemode='w')
+    logging.debug("===================================================================")
+    logging.debug("Logging started")
+
+def read_systems_csv(csv_file):
+    logging.info("Reading systems from %s" % csv_file)
+    with open(csv_file, newline='') as file:
+        rows = list(csv.DictReader(file))
+    logging.debug("Read %s systems" % len(rows))
+    return(rows)
+
+def find_bridge_gate(rows):
+    # First gate between two regions, used to chain synthetic copies together
+    regions = {int(r['ID']): r['Region'] for r in rows}
+    for r in rows:
+        for n in filter(None, r['Neighbors'].split(':')):
+            if int(n) in regions and regions[int(n)] != r['Region']:
+                return(int(r['ID']), int(n))
+    return(None)
+
+def generate_scaled_rows(rows, scale):
+    # Copy 0 is the original data, copy i gets IDs shifted by i*SYSTEM_ID_OFFSET
+    # and " #i" appended to region, constellation and system names.
+    logging.info("Generating %sx map from %s systems" % (scale, len(rows)))
+    bridge = find_bridge_gate(rows)
+    scaled = []
+    for i in range(scale):
+        offset = i * SYSTEM_ID_OFFSET
+        suffix = "" if i == 0 else " #%s" % i
+        for r in rows:
+            sid = int(r['ID']) + offset
+            neighbors = [str(int(n) + offset) for n in filter(None, r['Neighbors'].split(':'))]
+            if bridge and i > 0:
+                # Gate pair between this copy and the previous one
+                if sid == bridge[0] + offset:
+                    neighbors.append(str(bridge[1] + offset - SYSTEM_ID_OFFSET))
+            if bridge and i < scale - 1:
+                if sid == bridge[1] + offset:
+                    neighbors.append(str(bridge[0] + offset + SYSTEM_ID_OFFSET))
+            planets = [str(int(p) + offset) for p in filter(None, r['Planets'].split(':'))]
+            scaled.append({'ID': sid,
+                           'Region': r['Region'] + suffix,
+                           'Constellation': r['Constellation'] + suffix,
+                           'Name': r['Name'] + suffix,
+                           'Security': r['Security'],
+                           'Neighbors': ":".join(neighbors),
+                           'Planets': ":".join(planets)})
+    logging.debug("Generated %s systems" % len(scaled))
+    return(scaled)
+
+def create_benchmark_db(db_file, rows, seed):
+    # Same tables as import_csv_data.py. Planetary production is generated
+    # from a fixed seed so results stay comparable between runs.
+    logging.info("Creating benchmark database %s" % db_file)
+    rng = random.Random(seed)
+    db = sqlite3.connect(db_file)
+    c = db.cursor()
+    c.execute("CREATE TABLE systems(sid INTEGER NOT NULL PRIMARY KEY, region TEXT, constellation TEXT, name TEXT, security REAL)")
+    c.execute("CREATE TABLE neighbors(sid INTEGER, nid INTEGER, s_security REAL)")
+    c.execute("CREATE TABLE systemplanets(sid INTEGER, pid INTEGER)")
+    c.execute("CREATE TABLE planetary_production_data(pid INTEGER NOT NULL , name TEXT, type TEXT , resource TEXT, richness TEXT, output REAL)")
+    # Only for analyze.add_production_data(), which reads production data from
+    # table "planets". columnar.py reads planetary_production_data directly.
+    c.execute("CREATE VIEW planets AS SELECT * FROM planetary_production_data")
+
+    systems = []
+    neighbors = []
+    systemplanets = []
+    production = []
+    for r in rows:
+        systems.append((r['ID'], r['Region'], r['Constellation'], r['Name'], float(r['Security'])))
+        for n in filter(None, r['Neighbors'].split(':')):
+            neighbors.append((r['ID'], int(n), float(r['Security'])))
+        for p in filter(None, r['Planets'].split(':')):
+            systemplanets.append((r['ID'], int(p)))
+            for resource in rng.sample(RESOURCES, 2):
+                production.append((int(p), "%s %s" % (r['Name'], p), "Barren", resource, "Medium", round(rng.uniform(1, 50), 2)))
+
+    c.executemany("INSERT INTO systems VALUES (?,?,?,?,?)", systems)
+    c.executemany("INSERT INTO neighbors VALUES (?,?,?)", neighbors)
+    c.executemany("INSERT INTO systemplanets VALUES (?,?)", systemplanets)
+    c.executemany("INSERT INTO planetary_production_data VALUES (?,?,?,?,?,?)", production)
+    db.commit()
+    db.close()
+    logging.debug("Database has %s systems, %s gates and %s planets" % (len(systems), len(neighbors), len(systemplanets)))
+
+class BenchmarkMap:
+    # Working directory, database and base map for one scale. analyze.py uses
+    # relative db/, cache/ and pics/ paths, so stages run inside workdir. All
+    # stages share one database connection, closed by remove().
+
+    def __init__(self, rows, scale, seed):
+        self.scale = scale
+        self.workdir = tempfile.mkdtemp(prefix="ee_bench_%sx_" % scale)
+        for d in ["db", "cache", "pics", "log"]:
+            os.makedirs(os.path.join(self.workdir, d))
+        self.db_file = os.path.join(self.workdir, "db", "ee_map.db")
+        create_benchmark_db(self.db_file, generate_scaled_rows(rows, scale), seed)
+        self.db = self.open_db()
+        self.MAP = analyze.read_base_map_data(self.db)
+        self.start = analyze.convert_node_name_to_id(self.MAP, "Tash-Murkon Prime")
+        self.end = analyze.convert_node_name_to_id(self.MAP, "Pator" + ("" if scale == 1 else " #%s" % (scale - 1)))
+        self.region = "Tash-Murkon"
+
+    def open_db(self):
+        db = sqlite3.connect(self.db_file)
+        db.row_factory = sqlite3.Row
+        return(db)
+
+    def clear_cache(self):
+        for f in os.listdir(os.path.join(self.workdir, "cache")):
+            os.remove(os.path.join(self.workdir, "cache", f))
+
+    def remove(self):
+        self.db.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+# Stage setup functions get the BenchmarkMap and return a callable to time.
+# Setup work (map copies, column data) is not included in results.
+
+def setup_read_base_map_data(bm):
+    return(lambda: analyze.read_base_map_data(bm.db))
+
+def setup_add_production_data(bm):
+    MAP = bm.MAP.copy()
+    return(lambda: analyze.add_production_data(bm.db, MAP))
+
+def setup_load_map(bm):
+    bm.clear_cache()
+    return(analyze.load_map)
+
+def setup_remove_nodes_without_edge(bm):
+    MAP = bm.MAP.copy()
+    return(lambda: analyze.remove_nodes_without_edge(MAP))
+
+def setup_shortest_path(bm):
+    return(lambda: analyze.get_shortest_path_and_lenght(bm.MAP, bm.start, bm.end, "SHORT"))
+
+def setup_safe_path(bm):
+    return(lambda: analyze.get_shortest_path_and_lenght(bm.MAP, bm.start, bm.end, "SAFE"))
+
+def setup_longest_path(bm):
+    return(lambda: analyze.get_longest_path(bm.MAP))
+
+def setup_region_map(bm):
+    # Region and its synthetic copies are drawn as one region, so the drawn
+    # map has about 100 systems per scale
+    MAP = bm.MAP.copy()
+    for n, a in MAP.nodes(data=True):
+        if a['region'].split(" #")[0] == bm.region:
+            a['region'] = bm.region
+    return(lambda: analyze.generate_region_map(MAP, bm.region, False))
+
+def setup_full_map(bm):
+    MAP = bm.MAP.copy()
+    analyze.remove_nodes_without_edge(MAP)
+    return(lambda: analyze.generate_full_map(MAP, False))
+
+def setup_read_columns_from_db(bm):
+    return(lambda: columnar.read_columns_from_db(bm.db))
+
+def setup_columnar_rollups(bm):
+    columns = columnar.read_columns_from_db(bm.db)
+    def rollups():
+        columnar.get_resource_totals_per_region(columns)
+        columnar.get_resource_totals_per_constellation(columns)
+        columnar.get_security_distribution_per_region(columns)
+        columnar.get_security_distribution_per_constellation(columns)
+    return(rollups)
+
+def setup_report_routes(bm):
+    # Same route repeated, report written to /dev/null
+    columns = columnar.read_columns_from_db(bm.db)
+    index = report.MapIndex(columns)
+    G = report.build_route_graph(columns)
+    routes = [(bm.MAP.nodes[bm.start]['name'], bm.MAP.nodes[bm.end]['name'])] * 100
+    def run():
+        with open(os.devnull, "w") as out:
+            report.write_report(report.iter_route_rows(index, G, routes, "SAFE"), out, report.ROUTE_FIELDS, "jsonl")
+    return(run)
+
+# name, setup function, largest scale the stage is run on by default, slow.
+# All pairs path lengths and Kamada-Kawai layout are quadratic in time or
+# memory. Slow stages take minutes already on 1x: production data is queried
+# per system from unindexed tables and the full map layout has over 5000
+# systems. They are run only when named with --stages and are measured with
+# a single traced run.
+STAGES = [
+    ("read_base_map_data", setup_read_base_map_data, None, False),
+    ("add_production_data", setup_add_production_data, 1, True),
+    ("load_map", setup_load_map, 1, True),
+    ("remove_nodes_without_edge", setup_remove_nodes_without_edge, None, False),
+    ("shortest_path_short", setup_shortest_path, None, False),
+    ("shortest_path_safe", setup_safe_path, None, False),
+    ("get_longest_path", setup_longest_path, 1, False),
+    ("generate_region_map", setup_region_map, 10, False),
+    ("generate_full_map", setup_full_map, 1, True),
+    ("read_columns_from_db", setup_read_columns_from_db, None, False),
+    ("columnar_rollups", setup_columnar_rollups, None, False),
+    ("report_routes", setup_report_routes, None, False),
+]
+
+def measure_stage(bm, setup, repeat, slow):
+    # Best wall time of repeat runs without tracing, then one traced run for
+    # peak memory so tracemalloc overhead does not skew timings. Slow stages
+    # are run only once and their time includes tracing overhead.
+    if slow:
+        func = setup(bm)
+        tracemalloc.start()
+        try:
+            t = time.perf_counter()
+            func()
+            t = time.perf_counter() - t
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return(t, peak)
+    seconds = None
+    for i in range(repeat):
+        func = setup(bm)
+        t = time.perf_counter()
+        func()
+        t = time.perf_counter() - t
+        if seconds is None or t < seconds:
+            seconds = t
+    func = setup(bm)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return(seconds, peak)
+
+def run_benchmarks(rows, scales, stages, repeat, seed, no_limits, write):
+    # write(results) is called after each stage so an interrupted run keeps
+    # the results measured so far
+    results = []
+    cwd = os.getcwd()
+    for scale in scales:
+        print("Preparing %sx map" % scale)
+        bm = BenchmarkMap(rows, scale, seed)
+        nodes = bm.MAP.number_of_nodes()
+        edges = bm.MAP.number_of_edges()
+        logging.info("Benchmarking %sx map with %s nodes and %s edges" % (scale, nodes, edges))
+        os.chdir(bm.workdir)
+        try:
+            for name, setup, max_scale, slow in STAGES:
+                if (stages and name not in stages) or (not stages and slow):
+                    continue
+                result = {'scale': scale, 'stage': name, 'nodes': nodes, 'edges': edges,
+                          'seconds': None, 'peak_bytes': None, 'traced': slow, 'error': None}
+                if max_scale and scale > max_scale and not no_limits:
+                    logging.info("Skipping stage %s on %sx map" % (name, scale))
+                    result['error'] = "skipped"
+                    results.append(result)
+                    write(results)
+                    continue
+                print("%sx %s" % (scale, name))
+                try:
+                    result['seconds'], result['peak_bytes'] = measure_stage(bm, setup, repeat, slow)
+                except (Exception, SystemExit) as e:
+                    logging.exception("Stage %s failed on %sx map" % (name, scale))
+                    result['error'] = "%s: %s" % (type(e).__name__, e)
+                analyze.plt.close("all")
+                logging.info("%s" % result)
+                results.append(result)
+                write(results)
+        finally:
+            os.chdir(cwd)
+            bm.remove()
+    return(results)
+
+def write_results(results_file, results, args):
+    data = {'created': datetime.now().isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'networkx': nx.__version__,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'results': results}
+    if os.path.dirname(results_file):
+        os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    with open(results_file, "w") as file:
+        json.dump(data, file, indent=2)
+    logging.debug("%s results written to %s" % (len(results), results_file))
+
+def read_results(results_file):
+    with open(results_file) as file:
+        return(json.load(file)['results'])
+
+def format_value(value, unit):
+    if value is None:
+        return("-")
+    if unit == "s":
+        return("%.4fs" % value)
+    return("%.1fMiB" % (value / 1048576))
+
+def compare_results(baseline, current, threshold):
+    # Prints time and memory ratio current/baseline per scale and stage.
+    # Returns number of stages slower or bigger than threshold allows and
+    # by more than MIN_DIFFERENCE.
+    base = {(r['scale'], r['stage']): r for r in baseline}
+    regressions = 0
+    width = max(len(s[0]) for s in STAGES)
+    print("%-6s %-*s %12s %12s %7s %12s %12s %7s" % ("scale", width, "stage", "base time", "time", "ratio", "base mem", "mem", "ratio"))
+    for r in current:
+        b = base.get((r['scale'], r['stage']))
+        if b is None or r['error'] or b['error']:
+            note = r['error'] or (b and b['error']) or "not in baseline"
+            print("%-6s %-*s %s" % ("%sx" % r['scale'], width, r['stage'], note))
+            continue
+        line = "%-6s %-*s" % ("%sx" % r['scale'], width, r['stage'])
+        flags = []
+        for key, unit in [('seconds', "s"), ('peak_bytes', "b")]:
+            ratio = r[key] / b[key] if b[key] else 1.0
+            line += " %12s %12s %6.2fx" % (format_value(b[key], unit), format_value(r[key], unit), ratio)
+            if ratio > 1 + threshold and r[key] - b[key] > MIN_DIFFERENCE[key]:
+                flags.append("time" if unit == "s" else "memory")
+        if flags:
+            regressions += 1
+            line += "  REGRESSION (%s)" % ", ".join(flags)
+        print(line)
+    return(regressions)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark EVE Echoes map stages on real and synthetic scaled maps")
+    parser.add_argument("--csv", default="csv/systems.csv", help="systems CSV used as base map")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="map sizes as multiples of the base map")
+    parser.add_argument("--stages", nargs="+", choices=[s[0] for s in STAGES], help="run only these stages, needed for slow stages add_production_data, load_map and generate_full_map")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage, best is recorded")
+    parser.add_argument("--seed", type=int, default=1, help="seed for generated production data")
+    parser.add_argument("--no-limits", action="store_true", help="run quadratic stages on all scales")
+    parser.add_argument("--output", default="bench/benchmark_%s.json" % datetime.now().strftime("%Y-%m-%d-%H-%M-%S"), help="results file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare results to baseline results file")
+    parser.add_argument("--compare-only", nargs=2, metavar=("BASELINE", "RESULTS"), help="compare two results files without running")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a stage is a regression")
+    return(parser.parse_args(argv))
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Stages run inside temporary working directories
+    args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    if args.compare_only:
+        args.compare_only = [os.path.abspath(f) for f in args.compare_only]
+    init_logging()
+    logging.info("START")
+
+    if args.compare_only:
+        regressions = compare_results(read_results(args.compare_only[0]), read_results(args.compare_only[1]), args.threshold)
+    else:
+        rows = read_systems_csv(args.csv)
+        results = run_benchmarks(rows, args.scales, args.stages, args.repeat, args.seed, args.no_limits,
+                                 lambda results: write_results(args.output, results, args))
+        print("Results written to %s" % args.output)
+        regressions = 0
+        if args.compare:
+            regressions = compare_results(read_results(args.compare), results, args.threshold)
+
+    logging.info("END")
+    if regressions:
+        print("%s regressions found" % regressions)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
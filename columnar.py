@@ -0,0 +1,277 @@
+# EVE Echoes columnar map data
+#
+# Systems, edges and planetary production as NumPy arrays. Region,
+# constellation and resource are stored as categorical codes (index into
+# the sorted list of names) so grouped sums and counts are single
+# np.bincount calls instead of loops over map nodes.
+#
+# Usage:
+#   python columnar.py                       Export db/ee_map.db to cache/ee_map_columns.npz
+#   python columnar.py <file.npz>            Print region and constellation rollups
+
+# Standard modules
+import array
+import logging
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+
+# PIPed modules
+import numpy as np
+
+COLUMNS_FILE = "cache/ee_map_columns.npz"
+
+# Security groups use the same limits as analyze.get_nodes_grouped_by_security()
+SECURITY_GROUPS = ["nulsec", "lowsec", "highsec"]
+
+def init_logging():
+    logformat="%(asctime)s %(levelname)s %(filename)s %(funcName)s %(message)s"
+    logging.basicConfig(filename='log/columnar.log',level=logging.DEBUG,format=logformat,filemode='w')
+    logging.debug("===================================================================")
+    logging.debug("Logging started")
+
+def open_db():
+    db_file="db/ee_map.db"
+    logging.info("Using database file %s" % db_file)
+    db = sqlite3.connect(db_file)
+    return(db)
+
+def close_db(db):
+    db.close()
+    logging.debug("Database closed")
+
+# Text column read from database, codes index names in order of appearance
+Categorical = namedtuple("Categorical", ["names", "codes"])
+
+def encode_categories(values):
+    # Returns sorted category names and code of each value. Values may also be
+    # a Categorical from read_query_columns().
+    if isinstance(values, Categorical):
+        names, codes = values
+        order = np.argsort(names)
+        remap = np.empty(len(names), dtype=np.int32)
+        remap[order] = np.arange(len(names), dtype=np.int32)
+        return(names[order], remap[codes])
+    categories, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return(categories, codes.astype(np.int32))
+
+def read_query_columns(db, sql, types):
+    # Reads query result straight from the cursor into one array per column.
+    # Type is an array module typecode ("q" int64, "d" float64) or "c" for
+    # text stored as Categorical, so rows are never held as tuples.
+    buffers = [array.array("i" if t == "c" else t) for t in types]
+    names = [{} if t == "c" else None for t in types]
+    columns = list(zip(buffers, names))
+    for row in db.execute(sql):
+        for v, (buffer, n) in zip(row, columns):
+            if n is None:
+                buffer.append(v)
+            else:
+                buffer.append(n.setdefault(v, len(n)))
+    result = []
+    for t, buffer, n in zip(types, buffers, names):
+        values = np.frombuffer(buffer, dtype=np.int32 if t == "c" else np.dtype(t))
+        if n is None:
+            result.append(values)
+        else:
+            result.append(Categorical(np.array(list(n), dtype=str), values))
+    return(result)
+
+def get_security_groups(security):
+    # 0 = nulsec (<= 0), 1 = lowsec (< 0.5), 2 = highsec
+    return(np.where(security <= 0, 0, np.where(security < 0.5, 1, 2)).astype(np.int8))
+
+class MapColumns:
+    # Column arrays of one map. Edge and planet rows refer to systems by
+    # index (position in system_id), not by system ID.
+
+    def __init__(self, system_id, system_name, region, constellation, security,
+                 edge_source, edge_target, edge_security,
+                 planet_id, planet_system, planet_resource, planet_output):
+        self.system_id = np.asarray(system_id, dtype=np.int64)
+        self.system_name = np.asarray(system_name, dtype=str)
+        self.regions, self.region = encode_categories(region)
+        self.constellations, self.constellation = encode_categories(constellation)
+        self.security = np.asarray(security, dtype=np.float64)
+
+        self.edge_source = self.get_system_index(edge_source)
+        self.edge_target = self.get_system_index(edge_target)
+        self.edge_security = np.asarray(edge_security, dtype=np.float64)
+
+        self.planet_id = np.asarray(planet_id, dtype=np.int64)
+        self.planet_system = self.get_system_index(planet_system)
+        self.resources, self.planet_resource = encode_categories(planet_resource)
+        self.planet_output = np.asarray(planet_output, dtype=np.float64)
+
+        logging.debug("Columns for %s systems, %s edges and %s planet resources" % (len(self.system_id), len(self.edge_source), len(self.planet_id)))
+
+    def get_system_index(self, system_ids):
+        # System IDs to row indexes. Unknown IDs are an error.
+        system_ids = np.asarray(system_ids, dtype=np.int64)
+        if not len(system_ids):
+            return(np.zeros(0, dtype=np.int32))
+        if not len(self.system_id):
+            raise ValueError("Unknown system IDs in column data")
+        order = np.argsort(self.system_id)
+        pos = np.searchsorted(self.system_id, system_ids, sorter=order)
+        index = order[np.minimum(pos, len(order) - 1)]
+        if np.any(self.system_id[index] != system_ids):
+            raise ValueError("Unknown system IDs in column data")
+        return(index.astype(np.int32))
+
+    def __len__(self):
+        return(len(self.system_id))
+
+def get_production_table(db):
+    # import_csv_data.py creates planetary_production_data, older databases
+    # used by analyze.add_production_data() have it as planets
+    tables = [r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type IN ('table','view')")]
+    if "planetary_production_data" in tables or "planets" not in tables:
+        return("planetary_production_data")
+    return("planets")
+
+def read_columns_from_db(db):
+    # Whole tables are read with one query each
+    logging.info("Reading column data from database")
+
+    system_id, system_name, region, constellation, security = read_query_columns(db,
+        "SELECT sid,name,region,constellation,security FROM systems ORDER BY sid", "qcccd")
+    edge_source, edge_target, edge_security = read_query_columns(db,
+        "SELECT sid,nid,s_security FROM neighbors", "qqd")
+    # Planets are joined to systems here, SQLite would build a temporary
+    # index on the unindexed tables for every query
+    sp_system, sp_planet = read_query_columns(db, "SELECT sid,pid FROM systemplanets", "qq")
+    planet_id, planet_resource, planet_output = read_query_columns(db,
+        "SELECT pid,resource,output FROM %s" % get_production_table(db), "qcd")
+    # Rows pointing to systems missing from systems table are left out, like
+    # production rows of planets without a system below
+    known = np.isin(edge_source, system_id) & np.isin(edge_target, system_id)
+    if not known.all():
+        logging.warning("Skipping %s neighbors rows of unknown systems" % (~known).sum())
+        edge_source, edge_target, edge_security = edge_source[known], edge_target[known], edge_security[known]
+    known = np.isin(sp_system, system_id)
+    if not known.all():
+        logging.warning("Skipping %s systemplanets rows of unknown systems" % (~known).sum())
+        sp_system, sp_planet = sp_system[known], sp_planet[known]
+
+    order = np.argsort(sp_planet, kind="stable")
+    pos = np.minimum(np.searchsorted(sp_planet, planet_id, sorter=order), max(len(order) - 1, 0))
+    found = sp_planet[order[pos]] == planet_id if len(order) else np.zeros(len(planet_id), dtype=bool)
+    if not found.all():
+        logging.debug("Skipping %s production rows of planets without system" % (~found).sum())
+    planet_system = sp_system[order[pos[found]]]
+    planet_id = planet_id[found]
+    planet_resource = Categorical(planet_resource.names, planet_resource.codes[found])
+    planet_output = planet_output[found]
+
+    columns = MapColumns(system_id, system_name.names[system_name.codes], region, constellation, security,
+                         edge_source, edge_target, edge_security,
+                         planet_id, planet_system, planet_resource, planet_output)
+    logging.info("Column data ready")
+    return(columns)
+
+def read_columns_from_map(MAP):
+    # Same columns from a NetworkX map, e.g. cached map from analyze.load_map().
+    # Planet data is used if analyze.add_production_data() has been run.
+    logging.info("Reading column data from map of %s systems" % len(MAP))
+    nodes = list(MAP.nodes(data=True))
+    edges = list(MAP.edges(data='security_level'))
+    planets = [(n, p[0], p[1], p[2]) for n, a in nodes for p in a.get('planets', [])]
+    return(MapColumns([n for n, a in nodes], [a['name'] for n, a in nodes],
+                      [a['region'] for n, a in nodes], [a['constellation'] for n, a in nodes],
+                      [a['security'] for n, a in nodes],
+                      # Edges in analyze.read_base_map_data() point from neighbor to system
+                      [e[1] for e in edges], [e[0] for e in edges], [e[2] for e in edges],
+                      [p[1] for p in planets], [p[0] for p in planets],
+                      [p[2] for p in planets], [p[3] for p in planets]))
+
+def write_columns(columns, file=COLUMNS_FILE):
+    logging.info("Writing column data to %s" % file)
+    np.savez_compressed(file,
+        system_id=columns.system_id, system_name=columns.system_name,
+        region=columns.regions[columns.region], constellation=columns.constellations[columns.constellation],
+        security=columns.security,
+        edge_source=columns.system_id[columns.edge_source], edge_target=columns.system_id[columns.edge_target],
+        edge_security=columns.edge_security,
+        planet_id=columns.planet_id, planet_system=columns.system_id[columns.planet_system],
+        planet_resource=columns.resources[columns.planet_resource], planet_output=columns.planet_output)
+    logging.info("Column data written")
+
+def read_columns(file=COLUMNS_FILE):
+    if not os.path.exists(file):
+        logging.info("No column data file %s found." % file)
+        return(None)
+    logging.info("Reading column data from %s" % file)
+    with np.load(file) as d:
+        return(MapColumns(d['system_id'], d['system_name'], d['region'], d['constellation'], d['security'],
+                          d['edge_source'], d['edge_target'], d['edge_security'],
+                          d['planet_id'], d['planet_system'], d['planet_resource'], d['planet_output']))
+
+def group_sum(groups, n_groups, columns, n_columns, weights):
+    # Sum of weights per (group, column) pair as n_groups x n_columns matrix
+    flat = groups.astype(np.int64) * n_columns + columns
+    return(np.bincount(flat, weights=weights, minlength=n_groups * n_columns).reshape(n_groups, n_columns))
+
+def get_resource_totals_per_region(columns):
+    # Returns region names, resource names and total output matrix
+    logging.debug("Summing resource output per region")
+    region = columns.region[columns.planet_system]
+    totals = group_sum(region, len(columns.regions), columns.planet_resource, len(columns.resources), columns.planet_output)
+    return(columns.regions, columns.resources, totals)
+
+def get_resource_totals_per_constellation(columns):
+    logging.debug("Summing resource output per constellation")
+    constellation = columns.constellation[columns.planet_system]
+    totals = group_sum(constellation, len(columns.constellations), columns.planet_resource, len(columns.resources), columns.planet_output)
+    return(columns.constellations, columns.resources, totals)
+
+def get_security_distribution_per_region(columns):
+    # Returns region names, security group names and system count matrix
+    logging.debug("Counting security groups per region")
+    counts = group_sum(columns.region, len(columns.regions), get_security_groups(columns.security), len(SECURITY_GROUPS), None)
+    return(columns.regions, SECURITY_GROUPS, counts.astype(np.int64))
+
+def get_security_distribution_per_constellation(columns):
+    logging.debug("Counting security groups per constellation")
+    counts = group_sum(columns.constellation, len(columns.constellations), get_security_groups(columns.security), len(SECURITY_GROUPS), None)
+    return(columns.constellations, SECURITY_GROUPS, counts.astype(np.int64))
+
+def get_gates_between_regions(columns):
+    # Number of gates from region (row) to another region (column)
+    logging.debug("Counting gates between regions")
+    source = columns.region[columns.edge_source]
+    target = columns.region[columns.edge_target]
+    other = source != target
+    counts = group_sum(source[other], len(columns.regions), target[other], len(columns.regions), None)
+    return(columns.regions, counts.astype(np.int64))
+
+def print_rollup(title, groups, names, values):
+    print(title)
+    print("\t".join(["group"] + list(names)))
+    for g, v in zip(groups, values):
+        print("\t".join([str(g)] + ["%g" % x for x in v]))
+
+def main():
+    init_logging()
+    logging.info("START")
+
+    if len(sys.argv) > 1:
+        columns = read_columns(sys.argv[1])
+        if columns is None:
+            print("No column data file %s" % sys.argv[1])
+            sys.exit(1)
+        print_rollup("Resource output per region", *get_resource_totals_per_region(columns))
+        print_rollup("Security groups per constellation", *get_security_distribution_per_constellation(columns))
+    else:
+        db = open_db()
+        columns = read_columns_from_db(db)
+        close_db(db)
+        write_columns(columns)
+        print("Column data written to %s" % COLUMNS_FILE)
+
+    logging.info("END")
+
+
+if __name__ == "__main__":
+    main()
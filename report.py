@@ -0,0 +1,274 @@
+# EVE Echoes route and map diff reports
+#
+# Reports are generated row by row from in-memory column data (columnar.py)
+# and written out as JSON Lines or CSV while they are generated, so memory
+# use does not grow with report size.
+#
+# Usage:
+#   python report.py routes <routes.csv> [--security SAFE] [--format csv] [--output file]
+#       routes.csv has one "start,end" pair of system names per line
+#   python report.py diff <old dataset> <new dataset> [--format csv] [--output file]
+#       datasets are SQLite databases or .npz files written by columnar.py
+
+# Standard modules
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+# PIPed modules
+import networkx as nx
+import numpy as np
+
+# Local modules
+import columnar
+
+ROUTE_FIELDS = ["record", "route", "start", "end", "security_mode", "jumps", "step",
+                "sid", "name", "region", "constellation", "security",
+                "neighbor_sid", "neighbor_name", "neighbor_region", "neighbor_security", "on_path", "error"]
+
+DIFF_FIELDS = ["record", "sid", "name", "region", "constellation",
+               "old_security", "new_security", "neighbor_sid", "neighbor_name"]
+
+def init_logging():
+    logformat="%(asctime)s %(levelname)s %(filename)s %(funcName)s %(message)s"
+    logging.basicConfig(filename='log/report.log',level=logging.INFO,format=logformat,filemode='w')
+    logging.debug("===================================================================")
+    logging.debug("Logging started")
+
+class JsonLinesWriter:
+    # One JSON object per row
+
+    def __init__(self, file, fields):
+        self.file = file
+        self.fields = fields
+
+    def write(self, row):
+        self.file.write(json.dumps(row) + "\n")
+
+class CsvWriter:
+    # Fixed columns, missing values are left empty
+
+    def __init__(self, file, fields):
+        self.writer = csv.DictWriter(file, fieldnames=fields, restval="", lineterminator="\n")
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+WRITERS = {"jsonl": JsonLinesWriter, "csv": CsvWriter}
+
+def write_report(rows, file, fields, format="jsonl"):
+    # Consumes row generator and writes each row as it comes
+    writer = WRITERS[format](file, fields)
+    c = 0
+    for row in rows:
+        writer.write(row)
+        c = c + 1
+    logging.info("Wrote %s report rows" % c)
+    return(c)
+
+class MapIndex:
+    # Lookups for report rows: system name to index, and gates of each system
+    # as CSR arrays (gates of system i are gate_target[gate_start[i]:gate_start[i+1]]).
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.name_index = {n.lower(): i for i, n in enumerate(columns.system_name.tolist())}
+        order = np.argsort(columns.edge_source, kind="stable")
+        self.gate_target = columns.edge_target[order]
+        self.gate_start = np.concatenate(([0], np.cumsum(np.bincount(columns.edge_source, minlength=len(columns)))))
+
+        # Python lists are faster than NumPy scalars for row by row access
+        self.sid = columns.system_id.tolist()
+        self.name = columns.system_name.tolist()
+        self.region = columns.regions[columns.region].tolist()
+        self.constellation = columns.constellations[columns.constellation].tolist()
+        self.security = columns.security.tolist()
+        logging.debug("Index ready for %s systems" % len(self.sid))
+
+    def get_gates(self, i):
+        return(self.gate_target[self.gate_start[i]:self.gate_start[i + 1]].tolist())
+
+    def get_system(self, i):
+        return({'sid': self.sid[i], 'name': self.name[i], 'region': self.region[i],
+                'constellation': self.constellation[i], 'security': self.security[i]})
+
+def build_route_graph(columns):
+    # Graph of system indexes with same weights as analyze.read_base_map_data()
+    logging.info("Building route graph")
+    s = columns.edge_security
+    weight = np.where(s <= 0, 1000000, np.where(s < 0.5, 1000, 1))
+    G = nx.DiGraph()
+    G.add_nodes_from(range(len(columns)))
+    G.add_weighted_edges_from(zip(columns.edge_target.tolist(), columns.edge_source.tolist(), weight.tolist()), weight="security")
+    return(G)
+
+def find_route(G, start, end, security):
+    if security == "SHORT":
+        return(nx.shortest_path(G, source=start, target=end))
+    elif security == "SAFE":
+        return(nx.dijkstra_path(G, source=start, target=end, weight="security"))
+    raise ValueError("Unknown security type %s" % security)
+
+def iter_route_rows(index, G, routes, security="SHORT"):
+    # routes is an iterable of (start name, end name). For each route yields
+    # a "route" row, a "system" row per path step and a "gate" row per gate
+    # of that system.
+    for r, (start_name, end_name) in enumerate(routes, 1):
+        row = {'record': "route", 'route': r, 'start': start_name, 'end': end_name, 'security_mode': security}
+        if not start_name or not end_name:
+            row['error'] = "Route needs start and end system"
+            yield row
+            continue
+        start = index.name_index.get(start_name.lower())
+        end = index.name_index.get(end_name.lower())
+        if start is None or end is None:
+            row['error'] = "Unknown system %s" % (start_name if start is None else end_name)
+            yield row
+            continue
+        try:
+            path = find_route(G, start, end, security)
+        except nx.NetworkXNoPath:
+            row['error'] = "No route"
+            yield row
+            continue
+        row['jumps'] = len(path) - 1
+        yield row
+
+        for step, i in enumerate(path):
+            system = index.get_system(i)
+            row = {'record': "system", 'route': r, 'step': step}
+            row.update(system)
+            yield row
+            next_i = path[step + 1] if step + 1 < len(path) else None
+            for n in index.get_gates(i):
+                yield {'record': "gate", 'route': r, 'step': step,
+                       'sid': system['sid'], 'name': system['name'],
+                       'neighbor_sid': index.sid[n], 'neighbor_name': index.name[n],
+                       'neighbor_region': index.region[n], 'neighbor_security': index.security[n],
+                       'on_path': n == next_i}
+
+def read_routes(file):
+    # Yields (start, end) name pairs. Empty lines, lines starting with # and
+    # a start,end header are skipped. Missing names are yielded as "".
+    first = True
+    for line in csv.reader(file):
+        line = [f.strip() for f in line]
+        if not any(line) or line[0].startswith("#"):
+            continue
+        if first and [f.lower() for f in line[:2]] == ["start", "end"]:
+            first = False
+            continue
+        first = False
+        line = line + ["", ""]
+        yield (line[0], line[1])
+
+def get_gate_keys(columns):
+    # Gates as unique undirected (lower sid, higher sid) pairs packed in one int64
+    a = columns.system_id[columns.edge_source]
+    b = columns.system_id[columns.edge_target]
+    return(np.unique(np.minimum(a, b) << 32 | np.maximum(a, b)))
+
+def iter_diff_rows(old, new):
+    # Compares two datasets by system ID. Differences are found with sorted
+    # array set operations, rows are generated one at a time.
+    logging.info("Comparing %s old and %s new systems" % (len(old), len(new)))
+    old_index = MapIndex(old)
+    new_index = MapIndex(new)
+
+    common, old_pos, new_pos = np.intersect1d(old.system_id, new.system_id, assume_unique=True, return_indices=True)
+    removed = np.setdiff1d(np.arange(len(old)), old_pos, assume_unique=True)
+    added = np.setdiff1d(np.arange(len(new)), new_pos, assume_unique=True)
+    changed = old.security[old_pos] != new.security[new_pos]
+    logging.info("Found %s removed, %s added and %s security changed systems" % (len(removed), len(added), changed.sum()))
+
+    for i in removed.tolist():
+        row = old_index.get_system(i)
+        yield {'record': "system_removed", 'sid': row['sid'], 'name': row['name'], 'region': row['region'],
+               'constellation': row['constellation'], 'old_security': row['security']}
+    for i in added.tolist():
+        row = new_index.get_system(i)
+        yield {'record': "system_added", 'sid': row['sid'], 'name': row['name'], 'region': row['region'],
+               'constellation': row['constellation'], 'new_security': row['security']}
+    for o, n in zip(old_pos[changed].tolist(), new_pos[changed].tolist()):
+        row = new_index.get_system(n)
+        yield {'record': "security_changed", 'sid': row['sid'], 'name': row['name'], 'region': row['region'],
+               'constellation': row['constellation'], 'old_security': old_index.security[o], 'new_security': row['security']}
+
+    old_gates = get_gate_keys(old)
+    new_gates = get_gate_keys(new)
+    for record, keys, index in [("gate_removed", np.setdiff1d(old_gates, new_gates, assume_unique=True), old_index),
+                                ("gate_added", np.setdiff1d(new_gates, old_gates, assume_unique=True), new_index)]:
+        logging.info("Found %s %s rows" % (len(keys), record))
+        a = index.columns.get_system_index(keys >> 32).tolist()
+        b = index.columns.get_system_index(keys & 0xFFFFFFFF).tolist()
+        for i, n in zip(a, b):
+            yield {'record': record, 'sid': index.sid[i], 'name': index.name[i],
+                   'region': index.region[i], 'constellation': index.constellation[i],
+                   'neighbor_sid': index.sid[n], 'neighbor_name': index.name[n]}
+
+def read_dataset(file):
+    # SQLite database from import_csv_data.py or .npz from columnar.py
+    if file.endswith(".npz"):
+        columns = columnar.read_columns(file)
+        if columns is None:
+            raise FileNotFoundError("No column data file %s" % file)
+        return(columns)
+    if not os.path.exists(file):
+        # sqlite3.connect() would create an empty database
+        raise FileNotFoundError("No database file %s" % file)
+    logging.info("Using database file %s" % file)
+    db = sqlite3.connect(file)
+    columns = columnar.read_columns_from_db(db)
+    db.close()
+    return(columns)
+
+def parse_args(argv):
+    # Output options are shared by all reports and given after the report name
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=sorted(WRITERS), default="jsonl", help="output format")
+    output.add_argument("--output", help="output file, default is stdout")
+    parser = argparse.ArgumentParser(description="Stream EVE Echoes route and map diff reports")
+    sub = parser.add_subparsers(dest="report", required=True)
+    routes = sub.add_parser("routes", parents=[output], help="path details for start,end name pairs")
+    routes.add_argument("routes", help="CSV file of start,end pairs or - for stdin")
+    routes.add_argument("--dataset", default="db/ee_map.db", help="SQLite database or .npz column file")
+    routes.add_argument("--security", choices=["SHORT", "SAFE"], default="SHORT")
+    diff = sub.add_parser("diff", parents=[output], help="added/removed gates and systems and security changes")
+    diff.add_argument("old", help="SQLite database or .npz column file")
+    diff.add_argument("new", help="SQLite database or .npz column file")
+    return(parser.parse_args(argv))
+
+def main(argv=None):
+    args = parse_args(argv)
+    init_logging()
+    logging.info("START")
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        if args.report == "routes":
+            columns = read_dataset(args.dataset)
+            index = MapIndex(columns)
+            G = build_route_graph(columns)
+            routes_file = sys.stdin if args.routes == "-" else open(args.routes, newline="")
+            try:
+                write_report(iter_route_rows(index, G, read_routes(routes_file), args.security), out, ROUTE_FIELDS, args.format)
+            finally:
+                if routes_file is not sys.stdin:
+                    routes_file.close()
+        else:
+            rows = iter_diff_rows(read_dataset(args.old), read_dataset(args.new))
+            write_report(rows, out, DIFF_FIELDS, args.format)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    logging.info("END")
+
+
+if __name__ == "__main__":
+    main()